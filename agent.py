@@ -27,6 +27,8 @@ from typing import Annotated, Any
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from respostas_materializadas import RespostasMaterializadas
+
 logger = logging.getLogger("el-video-bot")
 logger.setLevel(logging.INFO)
 
@@ -46,6 +48,9 @@ def load_knowledge_base():
 
 KNOWLEDGE_BASE = load_knowledge_base()
 
+# Resultados locais das queries mais frequentes (atualizados quando as tabelas mudam)
+RESPOSTAS_MATERIALIZADAS = RespostasMaterializadas()
+
 
 # Configuração do banco de dados
 def get_db_connection():
@@ -464,14 +469,11 @@ Exemplos de insights:
                 query_sql += f" LIMIT {limite}"
 
             logger.info(f"Executando query: {query_sql}")
-            cursor.execute(query_sql)
-            results = cursor.fetchall()
-
-            # Pegar nomes das colunas
-            if cursor.description:
-                column_names = [desc[0] for desc in cursor.description]
-            else:
-                column_names = []
+            column_names, results, materializado = RESPOSTAS_MATERIALIZADAS.executar(
+                conn, cursor, query_sql
+            )
+            if materializado:
+                logger.info("Resultado obtido da materialização local (tabelas sem alterações)")
 
             cursor.close()
             conn.close()
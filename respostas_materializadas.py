@@ -0,0 +1,407 @@
+"""
+Respostas materializadas para as consultas mais frequentes do agente.
+
+Registra cada query executada por executar_query_customizada, identifica as
+que se repetem e guarda o resultado delas em um SQLite local. Antes de
+reutilizar um resultado, compara os contadores de pg_stat_user_tables das
+tabelas de origem com os salvos na materialização: se alguma tabela mudou, a
+query volta ao banco e a entrada é atualizada.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger("el-video-bot")
+
+# Built-ins cujo resultado muda sem que nenhuma tabela mude: palavras-chave
+# de data/hora, chamadas a funções dependentes de tempo, sorteio ou sequência
+# e literais como 'today' (avaliados quando a query é analisada)
+FUNCOES_VOLATEIS = re.compile(
+    r"\b(current_date|current_time|current_timestamp|localtime|localtimestamp)\b"
+    r"|\b(now|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday"
+    r"|random|random_normal|setseed|nextval|currval|lastval|setval"
+    r"|gen_random_uuid|uuid_generate_\w+|current_setting|age|pg_\w+|txid_\w+)\s*\("
+    r"|'(now|today|tomorrow|yesterday)'",
+    re.IGNORECASE,
+)
+
+# Chamadas de função nas expressões do plano (ex.: count(*), "MinhaFunc"(id))
+CHAMADA_FUNCAO = re.compile(r'(?:"([^"]+)"|([A-Za-z_][\w$]*))\(')
+
+# Funções com oid abaixo deste valor vêm do próprio PostgreSQL
+PRIMEIRO_OID_USUARIO = 16384
+
+# Nós do plano que leem dados fora de tabelas acompanhadas por pg_stat_user_tables
+NOS_NAO_RASTREAVEIS = {
+    "Function Scan",
+    "Table Function Scan",
+    "Foreign Scan",
+    "Custom Scan",
+    "Values Scan",
+    "Named Tuplestore Scan",
+    "Sample Scan",
+}
+
+# Versão das regras de recusa: ao mudar as regras, incremente para que as
+# queries recusadas por versões anteriores sejam reavaliadas
+VERSAO_REGRAS = 2
+
+
+def _inteiro_env(nome, padrao):
+    """Lê uma variável de ambiente inteira, usando o padrão se for inválida"""
+    valor = os.getenv(nome)
+    if valor is None:
+        return padrao
+    try:
+        return int(valor)
+    except ValueError:
+        logger.warning(f"{nome}={valor!r} não é um número inteiro, usando {padrao}")
+        return padrao
+
+
+def normalizar_query(query_sql):
+    """Remove espaços nas pontas; o interior fica intacto para não alterar literais"""
+    return query_sql.strip()
+
+
+def _relacoes_do_plano(plano, relacoes):
+    """Percorre o plano do EXPLAIN coletando as tabelas lidas.
+
+    Retorna False se algum nó ler dados que não podem ser rastreados.
+    """
+    if plano.get("Node Type") in NOS_NAO_RASTREAVEIS:
+        return False
+
+    if "Relation Name" in plano:
+        relacoes.add(f"{plano.get('Schema', 'public')}.{plano['Relation Name']}")
+
+    for subplano in plano.get("Plans", []):
+        if not _relacoes_do_plano(subplano, relacoes):
+            return False
+    return True
+
+
+def _expressoes_do_plano(plano):
+    """Retorna todas as expressões do plano VERBOSE (Output, Filter, Index Cond, ...)"""
+    expressoes = []
+    for chave, valor in plano.items():
+        if chave == "Plans":
+            for subplano in valor:
+                expressoes.extend(_expressoes_do_plano(subplano))
+        elif isinstance(valor, str):
+            expressoes.append(valor)
+        elif isinstance(valor, list):
+            expressoes.extend(item for item in valor if isinstance(item, str))
+    return expressoes
+
+
+def _funcoes_chamadas(expressoes):
+    """Nomes das funções chamadas nas expressões do plano"""
+    nomes = set()
+    for expressao in expressoes:
+        for citado, simples in CHAMADA_FUNCAO.findall(expressao):
+            if citado:
+                nomes.add(citado)
+            else:
+                nomes.update((simples, simples.lower()))
+    return nomes
+
+
+class RespostasMaterializadas:
+    """Registro de queries e armazenamento local dos resultados mais frequentes"""
+
+    def __init__(
+        self,
+        caminho=None,
+        min_execucoes=None,
+        max_entradas=None,
+        max_registros=None,
+        idade_maxima=None,
+        validade_recusa=None,
+    ):
+        if caminho is None:
+            caminho = os.getenv("MATERIALIZACAO_DB", "materializacao.sqlite3")
+        if min_execucoes is None:
+            min_execucoes = _inteiro_env("MATERIALIZACAO_MIN_EXECUCOES", 3)
+        if max_entradas is None:
+            max_entradas = _inteiro_env("MATERIALIZACAO_MAX_ENTRADAS", 200)
+        if max_registros is None:
+            max_registros = _inteiro_env("MATERIALIZACAO_MAX_REGISTROS", 1000)
+        if idade_maxima is None:
+            idade_maxima = _inteiro_env("MATERIALIZACAO_IDADE_MAXIMA", 600)
+        if validade_recusa is None:
+            validade_recusa = _inteiro_env("MATERIALIZACAO_VALIDADE_RECUSA", 3600)
+
+        self.caminho = caminho
+        self.min_execucoes = min_execucoes
+        self.max_entradas = max_entradas
+        self.max_registros = max_registros
+        # Segundos até uma entrada ser recalculada mesmo sem mudança detectada,
+        # pois os contadores de estatística podem atrasar ou perder escritas
+        self.idade_maxima = idade_maxima
+        # Segundos até uma query recusada ser reavaliada
+        self.validade_recusa = validade_recusa
+        # O SQLite só é aberto no primeiro uso, para não impedir o agente de iniciar
+        self._tabelas_criadas = False
+
+    @contextmanager
+    def _conectar(self):
+        """Abre o armazenamento local, confirmando a transação ao sair"""
+        local = sqlite3.connect(self.caminho, timeout=5)
+        try:
+            with local:
+                if not self._tabelas_criadas:
+                    self._criar_tabelas(local)
+                    self._tabelas_criadas = True
+                yield local
+        finally:
+            local.close()
+
+    def _criar_tabelas(self, local):
+        local.execute("""
+            CREATE TABLE IF NOT EXISTS registro_queries (
+                query TEXT PRIMARY KEY,
+                execucoes INTEGER NOT NULL,
+                ultima_execucao TEXT NOT NULL,
+                nao_materializavel INTEGER NOT NULL DEFAULT 0,
+                recusada_em TEXT
+            )
+        """)
+        # nao_materializavel guarda a VERSAO_REGRAS que recusou a query (0 = não
+        # recusada); armazenamentos antigos podem não ter as colunas
+        colunas = [linha[1] for linha in local.execute("PRAGMA table_info(registro_queries)")]
+        if "nao_materializavel" not in colunas:
+            local.execute(
+                "ALTER TABLE registro_queries ADD COLUMN nao_materializavel INTEGER NOT NULL DEFAULT 0"
+            )
+        if "recusada_em" not in colunas:
+            local.execute("ALTER TABLE registro_queries ADD COLUMN recusada_em TEXT")
+        local.execute("""
+            CREATE TABLE IF NOT EXISTS resultados_materializados (
+                query TEXT PRIMARY KEY,
+                assinatura TEXT NOT NULL,
+                colunas TEXT NOT NULL,
+                linhas TEXT NOT NULL,
+                atualizado_em TEXT NOT NULL,
+                ultimo_acesso TEXT NOT NULL
+            )
+        """)
+
+    def registrar_execucao(self, query):
+        """Conta mais uma execução da query.
+
+        Returns:
+            (execucoes, nao_materializavel), sendo nao_materializavel
+            verdadeiro só se a recusa veio das regras atuais e ainda é válida
+        """
+        agora = datetime.now()
+        with self._conectar() as local:
+            local.execute("""
+                INSERT INTO registro_queries (query, execucoes, ultima_execucao)
+                VALUES (?, 1, ?)
+                ON CONFLICT(query) DO UPDATE SET
+                    execucoes = execucoes + 1,
+                    ultima_execucao = excluded.ultima_execucao
+            """, (query, agora.isoformat()))
+            execucoes, versao_recusa, recusada_em = local.execute(
+                "SELECT execucoes, nao_materializavel, recusada_em FROM registro_queries WHERE query = ?",
+                (query,),
+            ).fetchone()
+
+            # Descartar as queries menos recentes quando o registro fica grande
+            local.execute("""
+                DELETE FROM registro_queries WHERE query IN (
+                    SELECT query FROM registro_queries
+                    ORDER BY ultima_execucao DESC
+                    LIMIT -1 OFFSET ?
+                )
+            """, (self.max_registros,))
+        nao_materializavel = (
+            versao_recusa == VERSAO_REGRAS
+            and recusada_em is not None
+            and (agora - datetime.fromisoformat(recusada_em)).total_seconds() < self.validade_recusa
+        )
+        return execucoes, nao_materializavel
+
+    def marcar_nao_materializavel(self, query):
+        """Evita repetir EXPLAIN e estatísticas para uma query recusada, até a recusa expirar"""
+        with self._conectar() as local:
+            local.execute(
+                "UPDATE registro_queries SET nao_materializavel = ?, recusada_em = ? WHERE query = ?",
+                (VERSAO_REGRAS, datetime.now().isoformat(), query),
+            )
+
+    def consultas_frequentes(self, limite=10):
+        """Lista as queries mais executadas: [(query, execucoes), ...]"""
+        with self._conectar() as local:
+            frequentes = local.execute("""
+                SELECT query, execucoes FROM registro_queries
+                ORDER BY execucoes DESC, ultima_execucao DESC
+                LIMIT ?
+            """, (limite,)).fetchall()
+        return frequentes
+
+    def assinatura_origem(self, conn, query):
+        """Calcula a assinatura de modificação das tabelas lidas pela query.
+
+        As tabelas vêm do plano do EXPLAIN (views, subqueries e partições já
+        resolvidas), e a assinatura combina relid e contadores de
+        pg_stat_user_tables de cada uma, mais o stats_reset do banco (após um
+        reset os contadores recomeçam do zero e poderiam repetir uma
+        assinatura antiga). Como o plano VERBOSE traz as expressões já
+        expandidas, funções dependentes de tempo escondidas em views e funções
+        do usuário, que podem ler outras tabelas, também são detectadas.
+
+        Returns:
+            A assinatura, ou None quando a query não pode ser materializada
+            com segurança
+        """
+        if FUNCOES_VOLATEIS.search(query):
+            return None
+
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"EXPLAIN (VERBOSE, FORMAT JSON) {query}")
+            plano = cursor.fetchone()[0]
+            if isinstance(plano, str):
+                plano = json.loads(plano)
+            plano = plano[0]["Plan"]
+
+            relacoes = set()
+            if not _relacoes_do_plano(plano, relacoes) or not relacoes:
+                return None
+
+            expressoes = _expressoes_do_plano(plano)
+            if any(FUNCOES_VOLATEIS.search(expressao) for expressao in expressoes):
+                return None
+
+            # Funções do usuário podem ler tabelas fora do plano. Built-ins são
+            # cobertos por FUNCOES_VOLATEIS: a volatilidade no pg_proc não serve
+            # aqui porque o plano só traz o nome, e basta uma sobrecarga estável
+            # (ex.: extract(text, timestamptz)) para recusar qualquer EXTRACT
+            funcoes = _funcoes_chamadas(expressoes)
+            if funcoes:
+                cursor.execute("""
+                    SELECT 1 FROM pg_proc
+                    WHERE proname = ANY(%s) AND oid >= %s
+                    LIMIT 1;
+                """, (sorted(funcoes), PRIMEIRO_OID_USUARIO))
+                if cursor.fetchone() is not None:
+                    return None
+
+            cursor.execute("""
+                SELECT t.schemaname || '.' || t.relname, t.relid,
+                       t.n_tup_ins, t.n_tup_upd, t.n_tup_del, t.n_live_tup,
+                       d.stats_reset, current_setting('track_counts')
+                FROM pg_stat_user_tables t, pg_stat_database d
+                WHERE d.datname = current_database()
+                AND t.schemaname || '.' || t.relname = ANY(%s)
+                ORDER BY 1;
+            """, (sorted(relacoes),))
+            contadores = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        # Tabelas de sistema ou temporárias não aparecem em pg_stat_user_tables
+        if len(contadores) != len(relacoes):
+            return None
+
+        # Sem track_counts os contadores nunca mudam
+        if contadores[0][-1] != "on":
+            return None
+
+        return json.dumps([list(linha[:-1]) for linha in contadores], default=str)
+
+    def buscar(self, query, assinatura):
+        """Retorna (colunas, linhas) materializadas se a assinatura ainda confere
+        e a entrada não passou da idade máxima"""
+        agora = datetime.now()
+        with self._conectar() as local:
+            entrada = local.execute(
+                "SELECT assinatura, colunas, linhas, atualizado_em FROM resultados_materializados WHERE query = ?",
+                (query,),
+            ).fetchone()
+            if entrada is None or entrada[0] != assinatura:
+                return None
+            if (agora - datetime.fromisoformat(entrada[3])).total_seconds() >= self.idade_maxima:
+                return None
+
+            local.execute(
+                "UPDATE resultados_materializados SET ultimo_acesso = ? WHERE query = ?",
+                (agora.isoformat(), query),
+            )
+        return json.loads(entrada[1]), json.loads(entrada[2])
+
+    def salvar(self, query, assinatura, colunas, linhas):
+        """Grava (ou atualiza) o resultado materializado de uma query"""
+        agora = datetime.now().isoformat()
+        with self._conectar() as local:
+            local.execute("""
+                INSERT OR REPLACE INTO resultados_materializados
+                    (query, assinatura, colunas, linhas, atualizado_em, ultimo_acesso)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                query,
+                assinatura,
+                json.dumps(colunas, ensure_ascii=False),
+                json.dumps(linhas, default=str, ensure_ascii=False),
+                agora,
+                agora,
+            ))
+
+            # Manter apenas as entradas acessadas mais recentemente
+            local.execute("""
+                DELETE FROM resultados_materializados WHERE query IN (
+                    SELECT query FROM resultados_materializados
+                    ORDER BY ultimo_acesso DESC
+                    LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entradas,))
+
+    def executar(self, conn, cursor, query_sql):
+        """Executa a query, respondendo pelo resultado materializado quando possível.
+
+        A assinatura é lida ANTES de executar a query: se uma tabela mudar
+        durante a execução, a próxima consulta verá uma assinatura diferente
+        e atualizará a entrada.
+
+        Returns:
+            (colunas, linhas, materializado)
+        """
+        query = normalizar_query(query_sql)
+        assinatura = None
+
+        try:
+            execucoes, nao_materializavel = self.registrar_execucao(query)
+            if execucoes >= self.min_execucoes and not nao_materializavel:
+                assinatura = self.assinatura_origem(conn, query)
+                if assinatura is None:
+                    self.marcar_nao_materializavel(query)
+                else:
+                    materializado = self.buscar(query, assinatura)
+                    if materializado is not None:
+                        colunas, linhas = materializado
+                        return colunas, linhas, True
+        except Exception as e:
+            # Falha na materialização nunca impede a resposta
+            logger.warning(f"Materialização indisponível para a query: {e}")
+            conn.rollback()
+            assinatura = None
+
+        cursor.execute(query_sql)
+        linhas = cursor.fetchall()
+        colunas = [desc[0] for desc in cursor.description] if cursor.description else []
+
+        if assinatura is not None:
+            try:
+                self.salvar(query, assinatura, colunas, [dict(linha) for linha in linhas])
+                logger.info(f"Resultado materializado: {query}")
+            except Exception as e:
+                logger.warning(f"Erro ao materializar resultado: {e}")
+
+        return colunas, linhas, False
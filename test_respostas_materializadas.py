@@ -0,0 +1,295 @@
+"""
+Testes das respostas materializadas (sem PostgreSQL: conexão e cursor simulados)
+"""
+from datetime import datetime, timedelta
+
+from respostas_materializadas import (
+    RespostasMaterializadas,
+    _relacoes_do_plano,
+    normalizar_query,
+)
+
+# Amostra de pg_proc: (proname, oid, provolatile)
+PG_PROC = [
+    ("count", 2803, "i"),
+    ("extract", 6202, "i"),
+    ("extract", 6203, "s"),
+    ("date_trunc", 2020, "i"),
+    ("date_trunc", 1217, "s"),
+    ("numeric", 3823, "s"),
+    ("minha_func", 16500, "v"),
+]
+
+
+def plano_cliente(filtro=None):
+    """Plano de um COUNT(*) GROUP BY estado sobre aws.cliente"""
+    scan = {"Node Type": "Seq Scan", "Relation Name": "cliente", "Schema": "aws",
+            "Output": ["estado"]}
+    if filtro:
+        scan["Filter"] = filtro
+    return {"Node Type": "Aggregate", "Output": ["estado", "count(*)"], "Plans": [scan]}
+
+
+class CursorFalso:
+    """Responde a EXPLAIN, pg_proc, pg_stat_user_tables e à query em si"""
+
+    description = [("estado",), ("total",)]
+
+    def __init__(self, banco):
+        self.banco = banco
+
+    def execute(self, sql, params=None):
+        self.sql = sql
+        self.params = params
+        self.banco.comandos.append(sql)
+
+    def fetchone(self):
+        if self.sql.startswith("EXPLAIN"):
+            return [[{"Plan": self.banco.plano}]]
+        if "pg_proc" in self.sql:
+            nomes, primeiro_oid = self.params
+            checa_volatilidade = "provolatile" in self.sql
+            encontradas = [
+                1 for nome, oid, volatilidade in PG_PROC
+                if nome in nomes
+                and (oid >= primeiro_oid or (checa_volatilidade and volatilidade != "i"))
+            ]
+            return (1,) if encontradas else None
+
+    def fetchall(self):
+        if "pg_stat_user_tables" in self.sql:
+            return [("aws.cliente", 123, self.banco.insercoes, 0, 0, self.banco.insercoes,
+                     self.banco.stats_reset, self.banco.track_counts)]
+        return [{"estado": "SP", "total": self.banco.insercoes}]
+
+    def close(self):
+        pass
+
+
+class ConexaoFalsa:
+    def __init__(self, plano=None):
+        self.plano = plano or plano_cliente()
+        self.insercoes = 5
+        self.stats_reset = datetime(2026, 1, 1)
+        self.track_counts = "on"
+        self.comandos = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        return CursorFalso(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def explains(self):
+        return sum(1 for sql in self.comandos if sql.startswith("EXPLAIN"))
+
+
+QUERY = "SELECT estado, COUNT(*) FROM aws.cliente GROUP BY estado LIMIT 10"
+
+
+def test_relacoes_do_plano_percorre_subplanos_e_particoes():
+    plano = {"Node Type": "Hash Join", "Plans": [
+        {"Node Type": "Seq Scan", "Relation Name": "cliente", "Schema": "aws"},
+        {"Node Type": "Hash", "Plans": [
+            {"Node Type": "Append", "Plans": [
+                {"Node Type": "Seq Scan", "Relation Name": "venda_2023", "Schema": "bc"},
+                {"Node Type": "Index Scan", "Relation Name": "venda_2024", "Schema": "bc"},
+            ]},
+        ]},
+    ]}
+    relacoes = set()
+    assert _relacoes_do_plano(plano, relacoes)
+    assert relacoes == {"aws.cliente", "bc.venda_2023", "bc.venda_2024"}
+
+
+def test_relacoes_do_plano_recusa_function_scan():
+    plano = {"Node Type": "Nested Loop", "Plans": [
+        {"Node Type": "Seq Scan", "Relation Name": "cliente", "Schema": "aws"},
+        {"Node Type": "Function Scan", "Function Name": "generate_series"},
+    ]}
+    assert not _relacoes_do_plano(plano, set())
+
+
+def test_normalizar_query_preserva_literais():
+    assert normalizar_query("  SELECT 1 \n") == "SELECT 1"
+    assert normalizar_query("SELECT * FROM t WHERE nome = 'a  b'") != \
+        normalizar_query("SELECT * FROM t WHERE nome = 'a b'")
+
+
+def test_registrar_execucao_conta_e_limita_registro(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), max_registros=2)
+    assert respostas.registrar_execucao("a") == (1, False)
+    assert respostas.registrar_execucao("a") == (2, False)
+    respostas.registrar_execucao("b")
+    respostas.registrar_execucao("c")
+    assert sorted(q for q, _ in respostas.consultas_frequentes()) == ["b", "c"]
+
+
+def test_buscar_exige_mesma_assinatura(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"))
+    assert respostas.buscar("q", "v1") is None
+    respostas.salvar("q", "v1", ["total"], [{"total": 7}])
+    assert respostas.buscar("q", "v1") == (["total"], [{"total": 7}])
+    assert respostas.buscar("q", "v2") is None
+
+
+def test_salvar_descarta_entrada_menos_acessada(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), max_entradas=2)
+    respostas.salvar("a", "v", [], [])
+    respostas.salvar("b", "v", [], [])
+    assert respostas.buscar("a", "v") is not None
+    respostas.salvar("c", "v", [], [])
+    assert respostas.buscar("b", "v") is None
+    assert respostas.buscar("a", "v") is not None
+    assert respostas.buscar("c", "v") is not None
+
+
+def test_executar_materializa_e_atualiza_quando_tabela_muda(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), min_execucoes=2)
+    conn = ConexaoFalsa()
+
+    assert respostas.executar(conn, conn.cursor(), QUERY)[2] is False
+    assert respostas.executar(conn, conn.cursor(), QUERY)[2] is False
+    colunas, linhas, materializado = respostas.executar(conn, conn.cursor(), QUERY)
+    assert materializado
+    assert linhas == [{"estado": "SP", "total": 5}]
+
+    conn.insercoes = 6
+    colunas, linhas, materializado = respostas.executar(conn, conn.cursor(), QUERY)
+    assert not materializado
+    assert linhas == [{"estado": "SP", "total": 6}]
+
+
+def test_executar_recusa_volatilidade_escondida_em_view(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), min_execucoes=1)
+    conn = ConexaoFalsa(plano=plano_cliente("(criado_em > (now() - '30 days'::interval))"))
+
+    respostas.executar(conn, conn.cursor(), "SELECT * FROM aws.vw_cliente_recente")
+    assert not respostas.executar(conn, conn.cursor(), "SELECT * FROM aws.vw_cliente_recente")[2]
+
+
+def test_executar_recusa_funcao_do_usuario(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), min_execucoes=1)
+    plano = plano_cliente()
+    plano["Output"] = ["minha_func(cliente.id)"]
+    conn = ConexaoFalsa(plano=plano)
+
+    query = "SELECT minha_func(id) FROM aws.cliente"
+    respostas.executar(conn, conn.cursor(), query)
+    assert not respostas.executar(conn, conn.cursor(), query)[2]
+    assert any("pg_proc" in sql for sql in conn.comandos)
+
+
+def test_executar_nao_repete_explain_de_query_nao_materializavel(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), min_execucoes=1)
+    conn = ConexaoFalsa(plano={"Node Type": "Function Scan", "Function Name": "generate_series"})
+
+    for _ in range(3):
+        respostas.executar(conn, conn.cursor(), "SELECT * FROM generate_series(1, 3)")
+    assert conn.explains() == 1
+
+
+def test_executar_cai_para_o_banco_quando_armazenamento_falha(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "inexistente" / "m.sqlite3"))
+    conn = ConexaoFalsa()
+
+    colunas, linhas, materializado = respostas.executar(conn, conn.cursor(), QUERY)
+    assert not materializado
+    assert colunas == ["estado", "total"]
+    assert conn.comandos == [QUERY]
+    assert conn.rollbacks == 1
+
+
+def test_configuracao_invalida_usa_padrao(monkeypatch):
+    monkeypatch.setenv("MATERIALIZACAO_MIN_EXECUCOES", "tres")
+    assert RespostasMaterializadas(caminho="nao_criado.sqlite3").min_execucoes == 3
+    assert RespostasMaterializadas(caminho="nao_criado.sqlite3", min_execucoes=0).min_execucoes == 0
+
+
+def test_executar_materializa_extract_e_date_trunc(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), min_execucoes=1)
+    plano = {
+        "Node Type": "Aggregate",
+        "Output": ["(EXTRACT(year FROM venda.data))", "(sum(venda.valor))::numeric(10,2)"],
+        "Group Key": ["EXTRACT(year FROM venda.data)"],
+        "Plans": [{
+            "Node Type": "Seq Scan", "Relation Name": "venda", "Schema": "bc",
+            "Alias": "venda",
+            "Output": ["EXTRACT(year FROM venda.data)", "venda.valor"],
+            "Filter": "(date_trunc('month'::text, venda.data) >= '2024-01-01'::date)",
+        }],
+    }
+    conn = ConexaoFalsa(plano=plano)
+    query = "SELECT EXTRACT(YEAR FROM data), SUM(valor)::numeric(10,2) FROM bc.venda GROUP BY 1"
+
+    respostas.executar(conn, conn.cursor(), query)
+    assert respostas.executar(conn, conn.cursor(), query)[2]
+
+
+def test_executar_nao_recusa_coluna_com_nome_de_funcao(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), min_execucoes=1)
+    plano = plano_cliente()
+    plano["Output"] = ["cliente.age", "count(*)"]
+    conn = ConexaoFalsa(plano=plano)
+    query = "SELECT age, COUNT(*) FROM aws.cliente GROUP BY age"
+
+    respostas.executar(conn, conn.cursor(), query)
+    assert respostas.executar(conn, conn.cursor(), query)[2]
+
+
+def test_executar_recusa_tablesample(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), min_execucoes=1)
+    conn = ConexaoFalsa(plano={"Node Type": "Sample Scan", "Relation Name": "cliente",
+                               "Schema": "aws"})
+    query = "SELECT * FROM aws.cliente TABLESAMPLE SYSTEM (1)"
+
+    respostas.executar(conn, conn.cursor(), query)
+    assert not respostas.executar(conn, conn.cursor(), query)[2]
+
+
+def test_executar_recusa_sem_track_counts(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), min_execucoes=1)
+    conn = ConexaoFalsa()
+    conn.track_counts = "off"
+
+    respostas.executar(conn, conn.cursor(), QUERY)
+    assert not respostas.executar(conn, conn.cursor(), QUERY)[2]
+
+
+def test_executar_atualiza_apos_reset_de_estatisticas(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), min_execucoes=1)
+    conn = ConexaoFalsa()
+    respostas.executar(conn, conn.cursor(), QUERY)
+
+    # Mesmos contadores, mas depois de um pg_stat_reset()
+    conn.stats_reset = datetime(2026, 2, 1)
+    assert not respostas.executar(conn, conn.cursor(), QUERY)[2]
+
+
+def test_buscar_respeita_idade_maxima(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), idade_maxima=0)
+    respostas.salvar("q", "v1", ["total"], [{"total": 7}])
+    assert respostas.buscar("q", "v1") is None
+
+
+def test_recusa_expira_e_e_reavaliada(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"), min_execucoes=1)
+    conn = ConexaoFalsa(plano={"Node Type": "Function Scan", "Function Name": "generate_series"})
+    query = "SELECT * FROM generate_series(1, 3)"
+    respostas.executar(conn, conn.cursor(), query)
+
+    respostas.validade_recusa = 0
+    respostas.executar(conn, conn.cursor(), query)
+    assert conn.explains() == 2
+
+
+def test_recusa_de_versao_anterior_e_ignorada(tmp_path):
+    respostas = RespostasMaterializadas(caminho=str(tmp_path / "m.sqlite3"))
+    respostas.registrar_execucao("q")
+    with respostas._conectar() as local:
+        local.execute(
+            "UPDATE registro_queries SET nao_materializavel = 1, recusada_em = ?",
+            ((datetime.now() - timedelta(seconds=1)).isoformat(),),
+        )
+    assert respostas.registrar_execucao("q") == (2, False)